@@ -1,24 +1,322 @@
 import time
-import json
+import orjson
 import pandas as pd
+import numpy as np
 from datetime import datetime
-from collections import deque
+from collections import defaultdict, deque, namedtuple
+from dataclasses import dataclass
 import logging
-from typing import Dict, List, Optional
+import logging.handlers
+import atexit
+import queue
+from typing import Dict, List, Optional, Union
 from dhanhq import DhanContext, dhanhq
-import websocket
+import asyncio
+import websockets
 import threading
+import socket
 import struct
+import sys
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import uvloop
+except ImportError:  # Optional: the feed falls back to the stock asyncio event loop
+    uvloop = None
+
+# Configure logging. Records are queued by the calling thread and written to stderr by a
+# background listener, so the feed threads never block on console I/O.
+_log_queue = queue.SimpleQueue()
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+logging.basicConfig(level=logging.INFO, handlers=[logging.handlers.QueueHandler(_log_queue)])
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Shared dictionary for live data (thread-safe for simple use)
 live_market_data = {}
 
-# Shared dictionary for all order flow history
-orderflow_history = {}
+# Ticks kept per security in orderflow_history; older ticks fall off the left
+ORDERFLOW_HISTORY_MAXLEN = 5000
+
+# Shared dictionary for all order flow history; a security's deque is created on first append
+orderflow_history = defaultdict(lambda: deque(maxlen=ORDERFLOW_HISTORY_MAXLEN))
+
+# Precompiled big-endian layouts of the binary feed packets
+_HDR = struct.Struct('>BHBI')           # code, msg_len, segment, security_id
+_TICKER = struct.Struct('>fI')          # Ticker packet body: ltp, ltt
+_OI = struct.Struct('>I')               # OI packet body
+
+# Header + body of a quote packet, so a batch of frames decodes with one np.frombuffer
+QUOTE_DTYPE = np.dtype([
+    ('code', 'u1'), ('msg_len', '>u2'), ('segment', 'u1'), ('security_id', '>u4'),
+    ('ltp', '>f4'), ('ltq', '>i2'), ('ltt', '>u4'), ('atp', '>f4'), ('volume', '>u4'),
+    ('sell_qty', '>u4'), ('buy_qty', '>u4'),
+    ('day_open', '>f4'), ('day_close', '>f4'), ('day_high', '>f4'), ('day_low', '>f4')
+])
+# Depth levels of one snapshot as float64 arrays, best level first
+_BookView = namedtuple('_BookView', ['bid_q', 'bid_p', 'ask_q', 'ask_p'])
+
+# What process_order_flow keeps from a security's last snapshot to compute the next one
+_FlowState = namedtuple('_FlowState', ['book_totals', 'traded', 'sig', 'flow'])
+
+# Analyzer snapshots kept in the order flow history ring buffer
+HISTORY_SIZE = 1000
+SIGNAL_NAMES = ('NEUTRAL_FLOW', 'BULLISH_FLOW', 'BEARISH_FLOW')  # signal column codes 0, 1, 2
+SIGNAL_CODES = {name: code for code, name in enumerate(SIGNAL_NAMES)}
+HISTORY_DTYPE = np.dtype([
+    ('ts', 'f8'), ('security_id', 'U32'), ('ltp', 'f8'), ('signal', 'u1'),
+    ('net_trade_flow', 'f8'), ('buy_qty_delta', 'f8'), ('sell_qty_delta', 'f8'),
+    ('buy_percentage', 'f8'), ('buy_intensity', 'f8'),
+    ('cumulative_buy_qty', 'f8'), ('cumulative_sell_qty', 'f8'), ('buy_sell_ratio', 'f8'),
+    ('imbalance_ratio', 'f8'), ('weighted_bid', 'f8'), ('weighted_ask', 'f8'), ('spread', 'f8'),
+    ('large_bid_count', 'i4'), ('large_ask_count', 'i4')
+])
+# Running totals up to and including each history row, for O(1) window sums in get_flow_summary.
+# Infinite imbalance ratios are counted separately so they don't poison the finite total, and rows
+# with a NaN or otherwise non-finite summed value are only counted, never added to the sums.
+_CUM_DTYPE = np.dtype([
+    ('imbalance', 'f8'), ('imbalance_inf', 'i8'), ('nonfinite', 'i8'), ('net_trade_flow', 'f8'),
+    ('buy_percentage', 'f8'), ('signals', 'i8', (len(SIGNAL_NAMES),))
+])
+
+QUOTE_BATCH_SIZE = 256    # Queued quote frames that are decoded without waiting for the timer
+QUOTE_FLUSH_SEC = 0.05    # Max time a quote frame waits to be decoded
+QUOTE_API_MAX_IDS = 1000  # Instruments per quote_data request (Dhan API limit)
+QUOTE_QUEUE_MAX = 65536   # Undecoded quote frames kept; the oldest are dropped beyond this
+WS_MAX_FRAME = 2 ** 16    # Largest feed message accepted; feed packets are at most a few hundred bytes
+WS_RECONNECT_SEC = 5      # Wait before reconnecting after the feed connection drops
+
+@dataclass(slots=True)
+class Tick:
+    """
+    One decoded WebSocket quote, as stored in data_store and orderflow_history
+    
+    orjson serializes it like the dict it replaces, with the same keys in the same order.
+    """
+    timestamp: str
+    ltp: float
+    last_traded_qty: int
+    ltt: int
+    atp: float
+    volume: int
+    sell_qty: int
+    buy_qty: int
+    day_open: float
+    day_close: float
+    day_high: float
+    day_low: float
+
+@dataclass(slots=True)
+class FlowSnapshot:
+    """
+    One process_order_flow result as flat fields; to_dict() gives the nested dict layout
+    
+    The traded delta fields are None on a security's first snapshot, and the order book
+    delta fields are None until there is a previous book to compare against.
+    """
+    ts_epoch: float
+    timestamp: str
+    security_id: str
+    ltp: float
+    
+    # PRIMARY: Traded quantity data
+    buy_quantity: float
+    sell_quantity: float
+    total_volume: float
+    net_traded: float
+    buy_sell_ratio: float
+    last_trade_time: str
+    buy_qty_delta: Optional[float]
+    sell_qty_delta: Optional[float]
+    volume_delta: Optional[float]
+    net_trade_flow: Optional[float]
+    buy_percentage: Optional[float]
+    sell_percentage: Optional[float]
+    buy_intensity: Optional[float]
+    sell_intensity: Optional[float]
+    flow_rate: Optional[float]
+    interval_volume: Optional[float]
+    
+    # SECONDARY: Order book data
+    imbalance_ratio: float
+    weighted_bid: float
+    weighted_ask: float
+    spread: float
+    large_bid_count: int
+    large_ask_count: int
+    max_bid_size: float
+    max_ask_size: float
+    avg_bid_size: float
+    avg_ask_size: float
+    bid_depth_ratio: float
+    ask_depth_ratio: float
+    top5_bid_qty: float
+    top5_ask_qty: float
+    deep_bid_qty: float
+    deep_ask_qty: float
+    order_bid_delta: Optional[float]
+    order_ask_delta: Optional[float]
+    order_net_flow: Optional[float]
+    
+    signal: str = 'NEUTRAL_FLOW'
+    
+    def to_dict(self) -> Dict:
+        """
+        Return the snapshot in the nested layout process_order_flow used to return
+        """
+        traded_delta = {}
+        if self.net_trade_flow is not None:
+            traded_delta = {
+                'buy_qty_delta': self.buy_qty_delta,
+                'sell_qty_delta': self.sell_qty_delta,
+                'volume_delta': self.volume_delta,
+                'net_trade_flow': self.net_trade_flow,
+                'buy_percentage': self.buy_percentage,
+                'sell_percentage': self.sell_percentage,
+                'buy_intensity': self.buy_intensity,
+                'sell_intensity': self.sell_intensity,
+                'flow_rate': self.flow_rate,
+                'interval_volume': self.interval_volume
+            }
+        order_book_delta = {}
+        if self.order_net_flow is not None:
+            order_book_delta = {
+                'order_bid_delta': self.order_bid_delta,
+                'order_ask_delta': self.order_ask_delta,
+                'order_net_flow': self.order_net_flow
+            }
+        return {
+            'timestamp': self.timestamp,
+            'ts_epoch': self.ts_epoch,
+            'security_id': self.security_id,
+            'ltp': self.ltp,
+            'traded_quantities': {
+                'buy_quantity': self.buy_quantity,
+                'sell_quantity': self.sell_quantity,
+                'total_volume': self.total_volume,
+                'last_trade_time': self.last_trade_time,
+                'timestamp': self.timestamp,
+                'ts_epoch': self.ts_epoch,
+                'net_traded': self.net_traded,
+                'buy_sell_ratio': self.buy_sell_ratio
+            },
+            'traded_delta': traded_delta,
+            'imbalance_ratio': self.imbalance_ratio,
+            'weighted_prices': {
+                'weighted_bid': self.weighted_bid,
+                'weighted_ask': self.weighted_ask,
+                'spread': self.spread
+            },
+            'large_orders': {
+                'large_bid_count': self.large_bid_count,
+                'large_ask_count': self.large_ask_count,
+                'max_bid_size': self.max_bid_size,
+                'max_ask_size': self.max_ask_size,
+                'avg_bid_size': self.avg_bid_size,
+                'avg_ask_size': self.avg_ask_size
+            },
+            'depth_analysis': {
+                'bid_depth_ratio': self.bid_depth_ratio,
+                'ask_depth_ratio': self.ask_depth_ratio,
+                'top5_bid_qty': self.top5_bid_qty,
+                'top5_ask_qty': self.top5_ask_qty,
+                'deep_bid_qty': self.deep_bid_qty,
+                'deep_ask_qty': self.deep_ask_qty
+            },
+            'order_book_delta': order_book_delta,
+            'signal': self.signal
+        }
+
+def _is_nonfinite_row(imbalance: float, net_trade_flow: float, buy_percentage: float) -> bool:
+    """
+    Whether a history row has a summed value the running totals cannot hold
+    
+    An infinite imbalance ratio is not counted here, because it has its own counter.
+    """
+    return bool(np.isnan(imbalance) or not np.isfinite(net_trade_flow) or not np.isfinite(buy_percentage))
+
+def score_signal(net_trade_flow: float, buy_percentage: float, buy_intensity: float,
+                 imbalance: float, large_bid_count: int, large_ask_count: int) -> str:
+    """
+    Turn the traded quantity and order book figures of a snapshot into a flow signal
+    
+    Returns:
+        Signal string (BULLISH_FLOW, BEARISH_FLOW, NEUTRAL_FLOW)
+    """
+    # Signal generation logic: each comparison counts as 0/1 towards its side's score.
+    # PRIMARY traded quantity signals (net flow, buy percentage, buy intensity) are
+    # weighted heavily; SECONDARY order book signals (imbalance, large orders) count once.
+    bullish_signals = (3 * (net_trade_flow > 0) + 2 * (buy_percentage > 60) + 2 * (buy_intensity > 0.6)
+                       + (imbalance > 1.5) + (large_bid_count > large_ask_count))
+    bearish_signals = (3 * (net_trade_flow < 0) + 2 * (buy_percentage < 40) + 2 * (buy_intensity < 0.4)
+                       + (imbalance < 0.67) + (large_ask_count > large_bid_count))
+    
+    # Generate final signal with stronger thresholds due to higher weights
+    if bullish_signals > bearish_signals + 2:
+        return "BULLISH_FLOW"
+    elif bearish_signals > bullish_signals + 2:
+        return "BEARISH_FLOW"
+    else:
+        return "NEUTRAL_FLOW"
+
+def compute_book_metrics(bid_q: np.ndarray, bid_p: np.ndarray, ask_q: np.ndarray,
+                         ask_p: np.ndarray, threshold_multiplier: float = 2.0) -> Dict:
+    """
+    Compute every order book metric of a snapshot in one pass over the depth arrays
+    
+    Each side is reduced once and imbalance, weighted prices, large orders and depth
+    distribution are all derived from the shared totals.
+    
+    Args:
+        bid_q: Bid quantities per level
+        bid_p: Bid prices per level
+        ask_q: Ask quantities per level
+        ask_p: Ask prices per level
+        threshold_multiplier: Multiplier for average size to detect large orders
+        
+    Returns:
+        Dictionary with imbalance_ratio, weighted_prices, large_orders and depth_analysis,
+        plus the bid_total and ask_total quantities they were derived from
+    """
+    bid_n, ask_n = bid_q.size, ask_q.size
+    bid_total = float(bid_q.sum())
+    ask_total = float(ask_q.sum())
+    top5_bid = float(bid_q[:5].sum())
+    top5_ask = float(ask_q[:5].sum())
+    # Quantities are whole lots, so the deep-book totals are exact by subtraction
+    deep_bid = bid_total - top5_bid
+    deep_ask = ask_total - top5_ask
+    avg_bid = bid_total / bid_n if bid_n else 0
+    avg_ask = ask_total / ask_n if ask_n else 0
+    weighted_bid = float(np.dot(bid_p, bid_q)) / bid_total if bid_total > 0 else 0
+    weighted_ask = float(np.dot(ask_p, ask_q)) / ask_total if ask_total > 0 else 0
+    
+    return {
+        'bid_total': bid_total,
+        'ask_total': ask_total,
+        'imbalance_ratio': bid_total / ask_total if ask_total != 0 else float('inf'),
+        'weighted_prices': {
+            'weighted_bid': weighted_bid,
+            'weighted_ask': weighted_ask,
+            'spread': weighted_ask - weighted_bid
+        },
+        'large_orders': {
+            'large_bid_count': int(np.count_nonzero(bid_q > avg_bid * threshold_multiplier)),
+            'large_ask_count': int(np.count_nonzero(ask_q > avg_ask * threshold_multiplier)),
+            'max_bid_size': float(bid_q.max()) if bid_n else 0,
+            'max_ask_size': float(ask_q.max()) if ask_n else 0,
+            'avg_bid_size': avg_bid,
+            'avg_ask_size': avg_ask
+        },
+        'depth_analysis': {
+            'bid_depth_ratio': top5_bid / deep_bid if deep_bid > 0 else float('inf'),
+            'ask_depth_ratio': top5_ask / deep_ask if deep_ask > 0 else float('inf'),
+            'top5_bid_qty': top5_bid,
+            'top5_ask_qty': top5_ask,
+            'deep_bid_qty': deep_bid,
+            'deep_ask_qty': deep_ask
+        }
+    }
 
 class OrderFlowAnalyzer:
     def __init__(self, client_id: str, access_token: str):
@@ -32,9 +330,13 @@ class OrderFlowAnalyzer:
         context = DhanContext(client_id=client_id, access_token=access_token)
         self.dhan = dhanhq(context)
 
-        self.order_flow_history = deque(maxlen=1000)  # Store last 1000 snapshots
-        self.previous_book = None
-        self.previous_traded_data = None  # Store previous traded quantities
+        # Last HISTORY_SIZE snapshots as a ring buffer; _hist_idx is the next slot to write
+        self._hist = np.zeros(HISTORY_SIZE, dtype=HISTORY_DTYPE)
+        self._hist_idx = 0
+        self._hist_count = 0
+        self._hist_cum = np.zeros(HISTORY_SIZE, dtype=_CUM_DTYPE)
+        self._totals = [0.0, 0, 0, 0.0, 0.0, [0] * len(SIGNAL_NAMES)]  # Running totals in _CUM_DTYPE order
+        self._flow_state = {}  # security_id -> _FlowState of its last processed snapshot
         self.signals = []
         
     def get_market_depth(self, security_id: str, exchange_segment: str = "NSE_FNO") -> Optional[Dict]:
@@ -47,34 +349,37 @@ class OrderFlowAnalyzer:
                 exchange_segment = "NSE_FNO"
 
             securities = {exchange_segment: [security_id_int]}
-            print(f"🔍 Requesting data: {securities}")  # Debug log
+            # Debug logs are guarded so the response is only formatted when DEBUG is on
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                logger.debug("🔍 Requesting data: %s", securities)
 
             response = self.dhan.quote_data(securities)
-            print("📦 Raw response from Dhan:\n", json.dumps(response, indent=2))
+            if debug:
+                logger.debug("📦 Raw response from Dhan:\n%s", orjson.dumps(response, option=orjson.OPT_INDENT_2, default=str).decode())
 
             # ✅ Check if API succeeded
             if response.get("status") != "success" or not response.get("data"):
-                print(f"⚠️ API failure: {response.get('remarks')}")
+                logger.warning("⚠️ API failure: %s", response.get('remarks'))
                 return None
 
             outer_data = response["data"]
             nested_data = outer_data.get("data", {})
             if exchange_segment not in nested_data:
-                print(f"⚠️ Exchange segment '{exchange_segment}' not found in response")
-                print(f"Available segments: {list(nested_data.keys())}")
+                logger.warning("⚠️ Exchange segment '%s' not found in response. Available segments: %s",
+                               exchange_segment, list(nested_data.keys()))
                 return None
 
             segment_data = nested_data[exchange_segment]
             security_data = segment_data.get(str(security_id)) or segment_data.get(str(security_id_int))
 
             if not security_data:
-                print(f"⚠️ Security ID '{security_id}' not found in {exchange_segment}")
-                print(f"Available IDs: {list(segment_data.keys())}")
+                logger.warning("⚠️ Security ID '%s' not found in %s. Available IDs: %s",
+                               security_id, exchange_segment, list(segment_data.keys()))
                 return None
 
-            print(f"✅ Successfully retrieved data for {security_id} on {exchange_segment}")
-            if response and isinstance(response, dict):
-                print("Received:", response)
+            if debug:
+                logger.debug("✅ Successfully retrieved data for %s on %s", security_id, exchange_segment)
             return security_data
 
         except ValueError as e:
@@ -84,23 +389,62 @@ class OrderFlowAnalyzer:
             logger.error(f"Error fetching market depth for {security_id} on {exchange_segment}: {e}")
         return None
 
-    def extract_traded_quantities(self, market_depth: Dict) -> Dict:
+    def get_market_depth_batch(self, security_ids: List[str], exchange_segment: str = "NSE_FNO") -> Dict[str, Dict]:
+        """
+        Get market depth for several securities with one quote_data request per QUOTE_API_MAX_IDS ids
+        
+        Args:
+            security_ids: Security identifiers
+            exchange_segment: Exchange segment shared by all the securities
+            
+        Returns:
+            Market depth per security_id; securities missing from the response are left out
+        """
+        books = {}
+        ids = [int(security_id) for security_id in security_ids]
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for i in range(0, len(ids), QUOTE_API_MAX_IDS):
+            securities = {exchange_segment: ids[i:i + QUOTE_API_MAX_IDS]}
+            try:
+                if debug:
+                    logger.debug("🔍 Requesting data: %s", securities)
+                response = self.dhan.quote_data(securities)
+                if response.get("status") != "success" or not response.get("data"):
+                    logger.warning("⚠️ API failure: %s", response.get('remarks'))
+                    continue
+                segment_data = response["data"].get("data", {}).get(exchange_segment)
+                if not segment_data:
+                    logger.warning("⚠️ Exchange segment '%s' not found in response", exchange_segment)
+                    continue
+                books.update((str(security_id), data) for security_id, data in segment_data.items())
+            except Exception as e:
+                logger.error(f"Error fetching market depth batch on {exchange_segment}: {e}")
+        return books
+
+    def extract_traded_quantities(self, market_depth: Dict, ts_epoch: float = None, ts_iso: str = None) -> Dict:
         """
         Extract traded quantity data from market depth response
         
         Args:
             market_depth: Market depth data from API
+            ts_epoch: Snapshot time as epoch seconds (optional, defaults to now)
+            ts_iso: The same time as an ISO string (optional, derived from ts_epoch)
             
         Returns:
             Dictionary with buy_quantity, sell_quantity, and volume data
         """
+        if ts_epoch is None:
+            ts_epoch = time.time()
+        if ts_iso is None:
+            ts_iso = datetime.fromtimestamp(ts_epoch).isoformat()
         try:
             traded_data = {
                 'buy_quantity': float(market_depth.get('buy_quantity', 0)),
                 'sell_quantity': float(market_depth.get('sell_quantity', 0)),
                 'total_volume': float(market_depth.get('volume', 0)),
                 'last_trade_time': market_depth.get('last_trade_time', ''),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': ts_iso,
+                'ts_epoch': ts_epoch  # Epoch seconds, so flow_rate subtracts floats instead of parsing timestamps
             }
             
             # Calculate net traded quantity (buy - sell)
@@ -123,7 +467,8 @@ class OrderFlowAnalyzer:
                 'net_traded': 0,
                 'buy_sell_ratio': 1.0,
                 'last_trade_time': '',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': ts_iso,
+                'ts_epoch': ts_epoch
             }
 
     def calculate_traded_quantity_delta(self, current_traded: Dict, previous_traded: Dict) -> Dict:
@@ -166,9 +511,7 @@ class OrderFlowAnalyzer:
             # Calculate time-based flow rate (if we have time data)
             flow_rate = 0
             try:
-                current_time = datetime.fromisoformat(current_traded['timestamp'])
-                previous_time = datetime.fromisoformat(previous_traded['timestamp'])
-                time_diff = (current_time - previous_time).total_seconds()
+                time_diff = current_traded['ts_epoch'] - previous_traded['ts_epoch']
                 if time_diff > 0:
                     flow_rate = net_trade_flow / time_diff  # Flow per second
             except:
@@ -202,91 +545,45 @@ class OrderFlowAnalyzer:
                 'interval_volume': 0
             }
 
-    def calculate_imbalance_ratio(self, market_depth: Dict) -> float:
+    def _depth_to_arrays(self, market_depth: Dict) -> _BookView:
         """
-        Calculate bid-ask imbalance ratio from order book
+        Parse the bid/ask levels of a market depth snapshot into NumPy arrays once
         
         Args:
             market_depth: Market depth data
             
         Returns:
-            Imbalance ratio (>1 = buying pressure, <1 = selling pressure)
+            _BookView of (bid_q, bid_p, ask_q, ask_p) float64 arrays, best level first
         """
-        try:
-            bid_levels = market_depth.get('depth', {}).get('buy', [])
-            ask_levels = market_depth.get('depth', {}).get('sell', [])
-            
-            total_bid_qty = sum(float(level.get('quantity', 0)) for level in bid_levels)
-            total_ask_qty = sum(float(level.get('quantity', 0)) for level in ask_levels)
-            
-            if total_ask_qty == 0:
-                return float('inf')
-            
-            return total_bid_qty / total_ask_qty
-        except Exception as e:
-            logger.error(f"Error calculating imbalance: {e}")
-            return 1.0
-    
-    def calculate_weighted_prices(self, market_depth: Dict) -> Dict[str, float]:
-        """
-        Calculate volume-weighted bid and ask prices
+        bid_levels = market_depth.get('depth', {}).get('buy', [])
+        ask_levels = market_depth.get('depth', {}).get('sell', [])
         
-        Args:
-            market_depth: Market depth data
-            
-        Returns:
-            Dictionary with weighted bid and ask prices
-        """
-        try:
-            bid_levels = market_depth.get('depth', {}).get('buy', [])
-            ask_levels = market_depth.get('depth', {}).get('sell', [])
-            
-            # Calculate weighted bid price
-            total_bid_value = sum(float(level.get('price', 0)) * float(level.get('quantity', 0)) 
-                                for level in bid_levels)
-            total_bid_qty = sum(float(level.get('quantity', 0)) for level in bid_levels)
-            
-            # Calculate weighted ask price
-            total_ask_value = sum(float(level.get('price', 0)) * float(level.get('quantity', 0)) 
-                                for level in ask_levels)
-            total_ask_qty = sum(float(level.get('quantity', 0)) for level in ask_levels)
-            
-            weighted_bid = total_bid_value / total_bid_qty if total_bid_qty > 0 else 0
-            weighted_ask = total_ask_value / total_ask_qty if total_ask_qty > 0 else 0
-            
-            return {
-                'weighted_bid': weighted_bid,
-                'weighted_ask': weighted_ask,
-                'spread': weighted_ask - weighted_bid
-            }
-        except Exception as e:
-            logger.error(f"Error calculating weighted prices: {e}")
-            return {'weighted_bid': 0, 'weighted_ask': 0, 'spread': 0}
-    
-    def calculate_order_book_delta(self, current_book: Dict, previous_book: Dict) -> Dict:
+        def column(levels, key):
+            # Gather the raw values, then let NumPy do the float conversion in one C call
+            values = np.array([level.get(key, 0) for level in levels], dtype=np.float64)
+            # NumPy turns None into NaN where float() raised; keep raising so callers use their defaults
+            if np.isnan(values).any():
+                raise ValueError(f"Missing {key} in market depth level")
+            return values
+        
+        return _BookView(column(bid_levels, 'quantity'), column(bid_levels, 'price'),
+                         column(ask_levels, 'quantity'), column(ask_levels, 'price'))
+
+    def calculate_order_book_delta(self, current_bid_qty: float, current_ask_qty: float,
+                                   previous_bid_qty: float, previous_ask_qty: float) -> Dict:
         """
         Calculate order book changes between snapshots (secondary metric)
         
         Args:
-            current_book: Current market depth
-            previous_book: Previous market depth
+            current_bid_qty: Total bid quantity of the current market depth
+            current_ask_qty: Total ask quantity of the current market depth
+            previous_bid_qty: Total bid quantity of the previous market depth
+            previous_ask_qty: Total ask quantity of the previous market depth
             
         Returns:
             Dictionary with bid/ask deltas
         """
         try:
-            # Current totals
-            current_bid_qty = sum(float(level.get('quantity', 0)) 
-                                for level in current_book.get('depth', {}).get('buy', []))
-            current_ask_qty = sum(float(level.get('quantity', 0)) 
-                                for level in current_book.get('depth', {}).get('sell', []))
-            
-            # Previous totals
-            previous_bid_qty = sum(float(level.get('quantity', 0)) 
-                                 for level in previous_book.get('depth', {}).get('buy', []))
-            previous_ask_qty = sum(float(level.get('quantity', 0)) 
-                                 for level in previous_book.get('depth', {}).get('sell', []))
-            
             bid_delta = current_bid_qty - previous_bid_qty
             ask_delta = current_ask_qty - previous_ask_qty
             net_flow = bid_delta - ask_delta
@@ -300,252 +597,280 @@ class OrderFlowAnalyzer:
             logger.error(f"Error calculating order book delta: {e}")
             return {'order_bid_delta': 0, 'order_ask_delta': 0, 'order_net_flow': 0}
     
-    def detect_large_orders(self, market_depth: Dict, threshold_multiplier: float = 2.0) -> Dict:
+    def process_order_flow(self, security_id: str, exchange_segment: str = "NSE_FNO") -> Optional[FlowSnapshot]:
         """
-        Detect unusually large orders in the book
+        Process complete order flow analysis for a security (enhanced with traded quantities)
         
         Args:
-            market_depth: Market depth data
-            threshold_multiplier: Multiplier for average size to detect large orders
+            security_id: Security identifier
+            exchange_segment: Exchange segment
             
         Returns:
-            Dictionary with large order detection results
+            Complete order flow analysis as a FlowSnapshot, or None if error
         """
         try:
-            bid_levels = market_depth.get('depth', {}).get('buy', [])
-            ask_levels = market_depth.get('depth', {}).get('sell', [])
-            
-            # Calculate average quantities
-            bid_quantities = [float(level.get('quantity', 0)) for level in bid_levels]
-            ask_quantities = [float(level.get('quantity', 0)) for level in ask_levels]
-            
-            avg_bid_qty = sum(bid_quantities) / len(bid_quantities) if bid_quantities else 0
-            avg_ask_qty = sum(ask_quantities) / len(ask_quantities) if ask_quantities else 0
+            # Get current market depth
+            current_book = self.get_market_depth(security_id, exchange_segment)
+            if not current_book:
+                return None
             
-            # Detect large orders
-            large_bids = [qty for qty in bid_quantities if qty > avg_bid_qty * threshold_multiplier]
-            large_asks = [qty for qty in ask_quantities if qty > avg_ask_qty * threshold_multiplier]
+            # One timestamp for the whole snapshot, shared by the traded data and flow data
+            return self._process_book(security_id, current_book, time.time())
             
-            return {
-                'large_bid_count': len(large_bids),
-                'large_ask_count': len(large_asks),
-                'max_bid_size': max(bid_quantities) if bid_quantities else 0,
-                'max_ask_size': max(ask_quantities) if ask_quantities else 0,
-                'avg_bid_size': avg_bid_qty,
-                'avg_ask_size': avg_ask_qty
-            }
         except Exception as e:
-            logger.error(f"Error detecting large orders: {e}")
-            return {'large_bid_count': 0, 'large_ask_count': 0, 'max_bid_size': 0, 'max_ask_size': 0}
+            logger.error(f"Error processing order flow: {e}")
+            return None
     
-    def analyze_depth_levels(self, market_depth: Dict) -> Dict:
+    def process_order_flow_batch(self, security_ids: List[str], exchange_segment: str = "NSE_FNO") -> Dict[str, FlowSnapshot]:
         """
-        Analyze order distribution across different depth levels
+        Process order flow for several securities from a single batched quote request
         
         Args:
-            market_depth: Market depth data
+            security_ids: Security identifiers
+            exchange_segment: Exchange segment shared by all the securities
             
         Returns:
-            Dictionary with depth analysis
+            FlowSnapshot per security_id; securities without data are left out
         """
+        results = {}
         try:
-            bid_levels = market_depth.get('depth', {}).get('buy', [])
-            ask_levels = market_depth.get('depth', {}).get('sell', [])
-            
-            # Top 5 levels vs deeper levels
-            top5_bid_qty = sum(float(level.get('quantity', 0)) for level in bid_levels[:5])
-            deep_bid_qty = sum(float(level.get('quantity', 0)) for level in bid_levels[5:])
-            
-            top5_ask_qty = sum(float(level.get('quantity', 0)) for level in ask_levels[:5])
-            deep_ask_qty = sum(float(level.get('quantity', 0)) for level in ask_levels[5:])
-            
-            # Calculate ratios
-            bid_depth_ratio = top5_bid_qty / deep_bid_qty if deep_bid_qty > 0 else float('inf')
-            ask_depth_ratio = top5_ask_qty / deep_ask_qty if deep_ask_qty > 0 else float('inf')
-            
-            return {
-                'bid_depth_ratio': bid_depth_ratio,
-                'ask_depth_ratio': ask_depth_ratio,
-                'top5_bid_qty': top5_bid_qty,
-                'top5_ask_qty': top5_ask_qty,
-                'deep_bid_qty': deep_bid_qty,
-                'deep_ask_qty': deep_ask_qty
-            }
-        except Exception as e:
-            logger.error(f"Error analyzing depth levels: {e}")
-            return {'bid_depth_ratio': 0, 'ask_depth_ratio': 0}
+            books = self.get_market_depth_batch(security_ids, exchange_segment)
+        except ValueError as e:
+            logger.error(f"Invalid security_id in batch: {e}")
+            return results
+        ts_epoch = time.time()
+        for security_id in security_ids:
+            current_book = books.get(str(int(security_id)))
+            if not current_book:
+                logger.warning("⚠️ Security ID '%s' not found in %s", security_id, exchange_segment)
+                continue
+            try:
+                results[security_id] = self._process_book(security_id, current_book, ts_epoch)
+            except Exception as e:
+                logger.error(f"Error processing order flow for {security_id}: {e}")
+        return results
     
-    def generate_order_flow_signals(self, flow_data: Dict) -> str:
+    def _process_book(self, security_id: str, current_book: Dict, ts_epoch: float) -> FlowSnapshot:
         """
-        Generate trading signals based on order flow analysis (now primarily using traded quantities)
+        Run the order flow analysis on a fetched market depth and update the security's state
         
         Args:
-            flow_data: Processed order flow data
+            security_id: Security identifier
+            current_book: Market depth returned by the quote API
+            ts_epoch: Snapshot time in epoch seconds
             
         Returns:
-            Signal string (BULLISH_FLOW, BEARISH_FLOW, NEUTRAL_FLOW)
+            FlowSnapshot for the market depth
         """
+        state = self._flow_state.get(security_id)
+        ts_iso = datetime.fromtimestamp(ts_epoch).isoformat()
+        
+        # Extract traded quantities (PRIMARY DATA)
+        current_traded = self.extract_traded_quantities(current_book, ts_epoch, ts_iso)
+        
+        # Polls between trades often return the same quote; reuse the previous snapshot
+        # instead of recomputing every metric and recording a duplicate in history
+        sig = (current_traded['total_volume'], current_traded['buy_quantity'],
+               current_traded['sell_quantity'], current_book.get('ltp'))
+        if state is not None and sig == state.sig:
+            return state.flow
+        
+        # Calculate traded quantity deltas if we have previous data
+        traded_delta = {}
+        if state is not None:
+            traded_delta = self.calculate_traded_quantity_delta(current_traded, state.traded)
+        
+        # Calculate secondary metrics from order book, parsing the depth levels once
         try:
-            # Primary signals from traded quantities
-            net_trade_flow = flow_data.get('traded_delta', {}).get('net_trade_flow', 0)
-            buy_percentage = flow_data.get('traded_delta', {}).get('buy_percentage', 50)
-            buy_intensity = flow_data.get('traded_delta', {}).get('buy_intensity', 0.5)
-            
-            # Secondary signals from order book
-            imbalance = flow_data.get('imbalance_ratio', 1.0)
-            large_bid_count = flow_data.get('large_orders', {}).get('large_bid_count', 0)
-            large_ask_count = flow_data.get('large_orders', {}).get('large_ask_count', 0)
-            
-            # Signal generation logic
-            bullish_signals = 0
-            bearish_signals = 0
-            
-            # PRIMARY: Traded quantity-based signals (weighted heavily)
-            if net_trade_flow > 0:
-                bullish_signals += 3  # Strong weight for actual trades
-            elif net_trade_flow < 0:
-                bearish_signals += 3
-            
-            # Buy percentage signals
-            if buy_percentage > 60:
-                bullish_signals += 2
-            elif buy_percentage < 40:
-                bearish_signals += 2
-            
-            # Buy intensity signals
-            if buy_intensity > 0.6:
-                bullish_signals += 2
-            elif buy_intensity < 0.4:
-                bearish_signals += 2
-            
-            # SECONDARY: Order book-based signals (lower weight)
-            if imbalance > 1.5:
-                bullish_signals += 1
-            elif imbalance < 0.67:
-                bearish_signals += 1
-            
-            # Large order signals
-            if large_bid_count > large_ask_count:
-                bullish_signals += 1
-            elif large_ask_count > large_bid_count:
-                bearish_signals += 1
-            
-            # Generate final signal with stronger thresholds due to higher weights
-            if bullish_signals > bearish_signals + 2:
-                return "BULLISH_FLOW"
-            elif bearish_signals > bullish_signals + 2:
-                return "BEARISH_FLOW"
-            else:
-                return "NEUTRAL_FLOW"
-                
+            book_metrics = compute_book_metrics(*self._depth_to_arrays(current_book))
+            book_totals = (book_metrics['bid_total'], book_metrics['ask_total'])
         except Exception as e:
-            logger.error(f"Error generating signals: {e}")
-            return "NEUTRAL_FLOW"
+            book_totals = None
+            logger.error(f"Error calculating order book metrics: {e}")
+            book_metrics = {
+                'imbalance_ratio': 1.0,
+                'weighted_prices': {'weighted_bid': 0, 'weighted_ask': 0, 'spread': 0},
+                'large_orders': {'large_bid_count': 0, 'large_ask_count': 0, 'max_bid_size': 0, 'max_ask_size': 0},
+                'depth_analysis': {'bid_depth_ratio': 0, 'ask_depth_ratio': 0}
+            }
+        
+        # Calculate order book deltas (secondary data)
+        order_delta = {}
+        if state is not None and state.book_totals is not None and book_totals is not None:
+            # Totals come from the metrics pass and the previous snapshot, so nothing is summed again
+            order_delta = self.calculate_order_book_delta(*book_totals, *state.book_totals)
+        
+        # Compile flow data
+        weighted_prices = book_metrics['weighted_prices']
+        large_orders = book_metrics['large_orders']
+        depth_analysis = book_metrics['depth_analysis']
+        flow_data = FlowSnapshot(
+            ts_epoch=ts_epoch,
+            timestamp=ts_iso,
+            security_id=security_id,
+            ltp=current_book.get('ltp') or current_book.get('last_price', 0),
+            
+            # PRIMARY: Traded quantity data
+            buy_quantity=current_traded['buy_quantity'],
+            sell_quantity=current_traded['sell_quantity'],
+            total_volume=current_traded['total_volume'],
+            net_traded=current_traded['net_traded'],
+            buy_sell_ratio=current_traded['buy_sell_ratio'],
+            last_trade_time=current_traded['last_trade_time'],
+            buy_qty_delta=traded_delta.get('buy_qty_delta'),
+            sell_qty_delta=traded_delta.get('sell_qty_delta'),
+            volume_delta=traded_delta.get('volume_delta'),
+            net_trade_flow=traded_delta.get('net_trade_flow'),
+            buy_percentage=traded_delta.get('buy_percentage'),
+            sell_percentage=traded_delta.get('sell_percentage'),
+            buy_intensity=traded_delta.get('buy_intensity'),
+            sell_intensity=traded_delta.get('sell_intensity'),
+            flow_rate=traded_delta.get('flow_rate'),
+            interval_volume=traded_delta.get('interval_volume'),
+            
+            # SECONDARY: Order book data
+            imbalance_ratio=book_metrics['imbalance_ratio'],
+            weighted_bid=weighted_prices['weighted_bid'],
+            weighted_ask=weighted_prices['weighted_ask'],
+            spread=weighted_prices['spread'],
+            large_bid_count=large_orders['large_bid_count'],
+            large_ask_count=large_orders['large_ask_count'],
+            max_bid_size=large_orders['max_bid_size'],
+            max_ask_size=large_orders['max_ask_size'],
+            avg_bid_size=large_orders.get('avg_bid_size', 0),
+            avg_ask_size=large_orders.get('avg_ask_size', 0),
+            bid_depth_ratio=depth_analysis['bid_depth_ratio'],
+            ask_depth_ratio=depth_analysis['ask_depth_ratio'],
+            top5_bid_qty=depth_analysis.get('top5_bid_qty', 0),
+            top5_ask_qty=depth_analysis.get('top5_ask_qty', 0),
+            deep_bid_qty=depth_analysis.get('deep_bid_qty', 0),
+            deep_ask_qty=depth_analysis.get('deep_ask_qty', 0),
+            order_bid_delta=order_delta.get('order_bid_delta'),
+            order_ask_delta=order_delta.get('order_ask_delta'),
+            order_net_flow=order_delta.get('order_net_flow')
+        )
+        
+        # Generate signal (now primarily based on traded quantities)
+        has_delta = flow_data.net_trade_flow is not None
+        flow_data.signal = score_signal(
+            flow_data.net_trade_flow if has_delta else 0,
+            flow_data.buy_percentage if has_delta else 50,
+            flow_data.buy_intensity if has_delta else 0.5,
+            flow_data.imbalance_ratio, flow_data.large_bid_count, flow_data.large_ask_count
+        )
+        
+        # Store data
+        self._record_history(flow_data)
+        self._flow_state[security_id] = _FlowState(book_totals, current_traded, sig, flow_data)
+        
+        return flow_data
     
-    def process_order_flow(self, security_id: str, exchange_segment: str = "NSE_FNO") -> Optional[Dict]:
+    def _record_history(self, flow_data: FlowSnapshot):
         """
-        Process complete order flow analysis for a security (enhanced with traded quantities)
+        Write the fields used by get_flow_summary and export_data_to_csv into the next ring slot
         
         Args:
-            security_id: Security identifier
-            exchange_segment: Exchange segment
-            
+            flow_data: Snapshot returned by process_order_flow
+        """
+        signal = SIGNAL_CODES[flow_data.signal]
+        has_delta = flow_data.net_trade_flow is not None
+        net_trade_flow = flow_data.net_trade_flow if has_delta else 0
+        buy_percentage = flow_data.buy_percentage if has_delta else 50
+        imbalance = flow_data.imbalance_ratio
+        self._hist[self._hist_idx] = (
+            flow_data.ts_epoch, flow_data.security_id, flow_data.ltp, signal,
+            net_trade_flow, flow_data.buy_qty_delta if has_delta else 0,
+            flow_data.sell_qty_delta if has_delta else 0, buy_percentage,
+            flow_data.buy_intensity if has_delta else 0.5,
+            flow_data.buy_quantity, flow_data.sell_quantity, flow_data.buy_sell_ratio,
+            imbalance, flow_data.weighted_bid, flow_data.weighted_ask, flow_data.spread,
+            flow_data.large_bid_count, flow_data.large_ask_count
+        )
+        totals = self._totals
+        if _is_nonfinite_row(imbalance, net_trade_flow, buy_percentage):
+            totals[2] += 1
+        else:
+            if np.isinf(imbalance):
+                totals[1] += 1
+            else:
+                totals[0] += imbalance
+            totals[3] += net_trade_flow
+            totals[4] += buy_percentage
+        totals[5][signal] += 1
+        self._hist_cum[self._hist_idx] = (totals[0], totals[1], totals[2], totals[3], totals[4], totals[5])
+        self._hist_idx = (self._hist_idx + 1) % HISTORY_SIZE
+        self._hist_count = min(self._hist_count + 1, HISTORY_SIZE)
+    
+    def _history(self) -> np.ndarray:
+        """
+        Return the recorded snapshots oldest first
+        """
+        if self._hist_count < HISTORY_SIZE:
+            return self._hist[:self._hist_count]
+        return np.concatenate((self._hist[self._hist_idx:], self._hist[:self._hist_idx]))
+    
+    def _slot(self, position: int) -> int:
+        """
+        Map a position in oldest-first order to its ring buffer slot
+        """
+        oldest = self._hist_idx if self._hist_count == HISTORY_SIZE else 0
+        return (oldest + position) % HISTORY_SIZE
+    
+    def _ring_searchsorted(self, column: np.ndarray, value, side: str = 'left') -> int:
+        """
+        np.searchsorted over a ring buffer column that is sorted oldest-first, without copying it
+        
         Returns:
-            Complete order flow analysis or None if error
+            Position in oldest-first order
         """
-        try:
-            # Get current market depth
-            current_book = self.get_market_depth(security_id, exchange_segment)
-            if not current_book:
-                return None
-            
-            # Extract traded quantities (PRIMARY DATA)
-            current_traded = self.extract_traded_quantities(current_book)
-            
-            # Calculate traded quantity deltas if we have previous data
-            traded_delta = {}
-            if self.previous_traded_data:
-                traded_delta = self.calculate_traded_quantity_delta(current_traded, self.previous_traded_data)
-            
-            # Calculate secondary metrics from order book
-            imbalance_ratio = self.calculate_imbalance_ratio(current_book)
-            weighted_prices = self.calculate_weighted_prices(current_book)
-            large_orders = self.detect_large_orders(current_book)
-            depth_analysis = self.analyze_depth_levels(current_book)
-            
-            # Calculate order book deltas (secondary data)
-            order_delta = {}
-            if self.previous_book:
-                order_delta = self.calculate_order_book_delta(current_book, self.previous_book)
-            
-            # Compile flow data
-            flow_data = {
-                'timestamp': datetime.now().isoformat(),
-                'security_id': security_id,
-                'ltp': current_book.get('ltp') or current_book.get('last_price', 0),
-                
-                # PRIMARY: Traded quantity data
-                'traded_quantities': current_traded,
-                'traded_delta': traded_delta,
-                
-                # SECONDARY: Order book data
-                'imbalance_ratio': imbalance_ratio,
-                'weighted_prices': weighted_prices,
-                'large_orders': large_orders,
-                'depth_analysis': depth_analysis,
-                'order_book_delta': order_delta
-            }
-            
-            # Generate signal (now primarily based on traded quantities)
-            signal = self.generate_order_flow_signals(flow_data)
-            flow_data['signal'] = signal
-            
-            # Store data
-            self.order_flow_history.append(flow_data)
-            self.previous_book = current_book
-            self.previous_traded_data = current_traded
-            
-            return flow_data
-            
-        except Exception as e:
-            logger.error(f"Error processing order flow: {e}")
-            return None
+        if self._hist_count < HISTORY_SIZE:
+            return int(np.searchsorted(column[:self._hist_count], value, side))
+        older, newer = column[self._hist_idx:], column[:self._hist_idx]
+        position = int(np.searchsorted(older, value, side))
+        if position < len(older):
+            return position
+        return len(older) + int(np.searchsorted(newer, value, side))
     
-    def run_continuous_monitoring(self, security_id: str, exchange_segment: str = "NSE_FNO", 
+    def run_continuous_monitoring(self, security_id: Union[str, List[str]], exchange_segment: str = "NSE_FNO", 
                                  interval: int = 1, duration: int = 3600):
         """
         Run continuous order flow monitoring with enhanced traded quantity tracking
         
         Args:
-            security_id: Security identifier
+            security_id: Security identifier, or a list of them fetched with one quote request per interval
             exchange_segment: Exchange segment
             interval: Monitoring interval in seconds
             duration: Total monitoring duration in seconds
         """
-        logger.info(f"Starting continuous monitoring for {security_id}")
+        security_ids = [security_id] if isinstance(security_id, str) else list(security_id)
+        logger.info(f"Starting continuous monitoring for {', '.join(security_ids)}")
         start_time = time.time()
+        last_logged = {}  # security_id -> snapshot last logged, to skip unchanged quotes
         
         try:
             while time.time() - start_time < duration:
-                flow_data = self.process_order_flow(security_id, exchange_segment)
-                
-                if flow_data:
+                for flow_data in self.process_order_flow_batch(security_ids, exchange_segment).values():
+                    # An unchanged quote returns the previous snapshot; it was already logged and alerted on
+                    if last_logged.get(flow_data.security_id) is flow_data:
+                        continue
+                    last_logged[flow_data.security_id] = flow_data
+                    
                     # Extract key metrics for logging
-                    traded_delta = flow_data.get('traded_delta', {})
-                    net_trade_flow = traded_delta.get('net_trade_flow', 0)
-                    buy_percentage = traded_delta.get('buy_percentage', 50)
+                    has_delta = flow_data.net_trade_flow is not None
+                    net_trade_flow = flow_data.net_trade_flow if has_delta else 0
+                    buy_percentage = flow_data.buy_percentage if has_delta else 50
                     
                     # Log key metrics
-                    logger.info(f"Time: {flow_data['timestamp'][:19]} | "
-                              f"LTP: {flow_data['ltp']:.2f} | "
+                    logger.info(f"{flow_data.security_id} | Time: {flow_data.timestamp[:19]} | "
+                              f"LTP: {flow_data.ltp:.2f} | "
                               f"Net Trade Flow: {net_trade_flow:.0f} | "
                               f"Buy%: {buy_percentage:.1f}% | "
-                              f"Imbalance: {flow_data['imbalance_ratio']:.2f} | "
-                              f"Signal: {flow_data['signal']}")
+                              f"Imbalance: {flow_data.imbalance_ratio:.2f} | "
+                              f"Signal: {flow_data.signal}")
                     
                     # Alert on strong signals
-                    if flow_data['signal'] in ['BULLISH_FLOW', 'BEARISH_FLOW']:
-                        logger.warning(f"🚨 ALERT: {flow_data['signal']} detected! "
+                    if flow_data.signal in ['BULLISH_FLOW', 'BEARISH_FLOW']:
+                        logger.warning(f"🚨 ALERT: {flow_data.signal} detected! "
                                      f"Net Trade Flow: {net_trade_flow:.0f}, "
                                      f"Buy Percentage: {buy_percentage:.1f}%")
                 
@@ -569,29 +894,54 @@ class OrderFlowAnalyzer:
         try:
             cutoff_time = datetime.now().timestamp() - (lookback_minutes * 60)
             
-            recent_data = [
-                data for data in self.order_flow_history
-                if datetime.fromisoformat(data['timestamp']).timestamp() > cutoff_time
-            ]
+            # Snapshot times increase oldest-first, so the window start is a binary search
+            count = self._hist_count
+            recent = count - self._ring_searchsorted(self._hist['ts'], cutoff_time, 'right')
             
-            if not recent_data:
+            if not recent:
                 return {}
             
-            # Calculate summary statistics
-            avg_imbalance = sum(d['imbalance_ratio'] for d in recent_data) / len(recent_data)
-            
-            # Traded quantity summaries
-            total_net_trade_flow = sum(d.get('traded_delta', {}).get('net_trade_flow', 0) for d in recent_data)
-            avg_buy_percentage = sum(d.get('traded_delta', {}).get('buy_percentage', 50) for d in recent_data) / len(recent_data)
-            
-            signal_counts = {}
-            for data in recent_data:
-                signal = data['signal']
-                signal_counts[signal] = signal_counts.get(signal, 0) + 1
+            # Window totals are the newest running total minus the one before the window starts
+            first = self._hist[self._slot(count - recent)]
+            first_cum = self._hist_cum[self._slot(count - recent)]
+            last_cum = self._hist_cum[self._slot(count - 1)]
+            first_imbalance = float(first['imbalance_ratio'])
+            first_net_trade_flow = float(first['net_trade_flow'])
+            first_buy_percentage = float(first['buy_percentage'])
+            first_is_nonfinite = _is_nonfinite_row(first_imbalance, first_net_trade_flow, first_buy_percentage)
+            
+            if last_cum['nonfinite'] - first_cum['nonfinite'] + first_is_nonfinite:
+                # Rare: the window holds a non-finite value the running sums skipped, so average
+                # its rows directly and let NaN/inf propagate the way they always did
+                window = self._history()[count - recent:]
+                avg_imbalance = float(window['imbalance_ratio'].mean())
+                total_net_trade_flow = float(window['net_trade_flow'].sum())
+                avg_buy_percentage = float(window['buy_percentage'].mean())
+            else:
+                # Calculate summary statistics
+                if last_cum['imbalance_inf'] - first_cum['imbalance_inf'] + np.isinf(first_imbalance):
+                    avg_imbalance = float('inf')
+                else:
+                    avg_imbalance = float(last_cum['imbalance'] - first_cum['imbalance'] + first_imbalance) / recent
+                
+                # Traded quantity summaries
+                total_net_trade_flow = float(last_cum['net_trade_flow'] - first_cum['net_trade_flow'] + first_net_trade_flow)
+                avg_buy_percentage = float(last_cum['buy_percentage'] - first_cum['buy_percentage'] + first_buy_percentage) / recent
+            
+            # Signal counts in order of first appearance, so ties resolve as before. Running
+            # signal counts are non-decreasing, so each signal's first row in the window is
+            # where its count first rises above the count before the window.
+            first_seen = {}
+            for code, name in enumerate(SIGNAL_NAMES):
+                before = int(first_cum['signals'][code]) - int(first['signal'] == code)
+                if last_cum['signals'][code] > before:
+                    first_seen[name] = (self._ring_searchsorted(self._hist_cum['signals'][:, code], before, 'right'),
+                                        int(last_cum['signals'][code]) - before)
+            signal_counts = {name: n for name, (_, n) in sorted(first_seen.items(), key=lambda x: x[1][0])}
             
             return {
                 'period_minutes': lookback_minutes,
-                'data_points': len(recent_data),
+                'data_points': recent,
                 'avg_imbalance_ratio': avg_imbalance,
                 'total_net_trade_flow': total_net_trade_flow,
                 'avg_buy_percentage': avg_buy_percentage,
@@ -603,6 +953,18 @@ class OrderFlowAnalyzer:
             logger.error(f"Error generating flow summary: {e}")
             return {}
     
+    def _history_frame(self) -> pd.DataFrame:
+        """
+        Build the export DataFrame straight from the history ring buffer columns
+        """
+        # pandas takes the structured array column by column; history columns are already in
+        # export order after ts, which becomes the ISO timestamp column
+        history = self._history()
+        df = pd.DataFrame.from_records(history, exclude=['ts'])
+        df.insert(0, 'timestamp', [datetime.fromtimestamp(ts).isoformat() for ts in history['ts'].tolist()])
+        df['signal'] = np.array(SIGNAL_NAMES)[history['signal']]
+        return df
+    
     def export_data_to_csv(self, filename: str = None):
         """
         Export order flow data to CSV (enhanced with traded quantity data)
@@ -614,40 +976,27 @@ class OrderFlowAnalyzer:
             if not filename:
                 filename = f"order_flow_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
             
-            # Convert to DataFrame
-            df_data = []
-            for data in self.order_flow_history:
-                traded_delta = data.get('traded_delta', {})
-                traded_quantities = data.get('traded_quantities', {})
-                
-                row = {
-                    'timestamp': data['timestamp'],
-                    'security_id': data['security_id'],
-                    'ltp': data['ltp'],
-                    'signal': data['signal'],
-                    
-                    # Primary traded quantity metrics
-                    'net_trade_flow': traded_delta.get('net_trade_flow', 0),
-                    'buy_qty_delta': traded_delta.get('buy_qty_delta', 0),
-                    'sell_qty_delta': traded_delta.get('sell_qty_delta', 0),
-                    'buy_percentage': traded_delta.get('buy_percentage', 50),
-                    'buy_intensity': traded_delta.get('buy_intensity', 0.5),
-                    'cumulative_buy_qty': traded_quantities.get('buy_quantity', 0),
-                    'cumulative_sell_qty': traded_quantities.get('sell_quantity', 0),
-                    'buy_sell_ratio': traded_quantities.get('buy_sell_ratio', 1.0),
-                    
-                    # Secondary order book metrics
-                    'imbalance_ratio': data['imbalance_ratio'],
-                    'weighted_bid': data['weighted_prices']['weighted_bid'],
-                    'weighted_ask': data['weighted_prices']['weighted_ask'],
-                    'spread': data['weighted_prices']['spread'],
-                    'large_bid_count': data['large_orders']['large_bid_count'],
-                    'large_ask_count': data['large_orders']['large_ask_count']
-                }
-                df_data.append(row)
-            
-            df = pd.DataFrame(df_data)
-            df.to_csv(filename, index=False)
+            self._history_frame().to_csv(filename, index=False)
+            logger.info(f"Data exported to {filename}")
+            
+        except Exception as e:
+            logger.error(f"Error exporting data: {e}")
+    
+    def export_data_to_feather(self, filename: str = None):
+        """
+        Export order flow data to a Feather (Arrow IPC) file
+        
+        Same columns as export_data_to_csv, written as typed binary columns instead of text,
+        which is much faster to write and read back for a long-running monitor.
+        
+        Args:
+            filename: Output filename (optional)
+        """
+        try:
+            if not filename:
+                filename = f"order_flow_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.feather"
+            
+            self._history_frame().to_feather(filename)
             logger.info(f"Data exported to {filename}")
             
         except Exception as e:
@@ -657,63 +1006,118 @@ class DhanWebSocketClient:
     def __init__(self, access_token, client_id, instrument_list, data_store):
         self.access_token = access_token
         self.client_id = client_id
-        self.instrument_list = instrument_list  # List of dicts: {"ExchangeSegment": ..., "SecurityId": ...}
+        # List of dicts: {"ExchangeSegment": ..., "SecurityId": ...}, normalized to the strings the feed expects
+        self.instrument_list = [{"ExchangeSegment": str(instrument["ExchangeSegment"]),
+                                 "SecurityId": str(instrument["SecurityId"])} for instrument in instrument_list]
         self.ws_url = f"wss://api-feed.dhan.co?version=2&token={access_token}&clientId={client_id}&authType=2"
         self.ws = None
         self.data_store = data_store
+        # Raw quote frames waiting to be decoded in a batch by flush(). Bounded so a stalled
+        # decoder drops the oldest live ticks instead of growing without limit.
+        self._rx_queue = deque(maxlen=QUOTE_QUEUE_MAX)
+        # Interned data_store / orderflow_history key per subscribed security id
+        self._sid_keys = {}
+        for instrument in self.instrument_list:
+            sid = int(instrument["SecurityId"])
+            self._sid_keys[sid] = sys.intern(str(sid))
+        # Parse errors since the last report, and when that report was logged (time.monotonic)
+        self._err_count = 0
+        self._err_last = 0.0
+        # (minimum frame length, handler) by response code
+        self._handlers = {4: (QUOTE_DTYPE.itemsize, self._handle_quote),
+                          2: (8 + _TICKER.size, self._handle_ticker),
+                          5: (8 + _OI.size, self._handle_oi)}
+        # Subscription messages (max 100 instruments per message) serialized once, as (count, json)
+        batch_size = 100
+        self._subscriptions = []
+        for i in range(0, len(self.instrument_list), batch_size):
+            batch = self.instrument_list[i:i+batch_size]
+            subscribe_message = {
+                "RequestCode": 17,
+                "InstrumentCount": len(batch),
+                "InstrumentList": batch
+            }
+            self._subscriptions.append((len(batch), orjson.dumps(subscribe_message).decode()))
 
     def on_message(self, ws, message):
-        print("[WebSocket] Received message of length:", len(message))
-        if len(message) < 8:
-            return
-        code, msg_len, segment, security_id = struct.unpack(">BHB I", message[:8])
-        print(f"[WebSocket] Header: code={code}, msg_len={msg_len}, segment={segment}, security_id={security_id}")
+        # Per-frame diagnostics go through a guarded logger.debug so nothing is formatted in production
+        debug = logger.isEnabledFor(logging.DEBUG)
         try:
-            if code == 4 and len(message) >= 50:
-                # Quote Packet
-                ltp, = struct.unpack(">f", message[8:12])
-                last_traded_qty, = struct.unpack(">h", message[12:14])
-                ltt, = struct.unpack(">I", message[14:18])
-                atp, = struct.unpack(">f", message[18:22])
-                volume, = struct.unpack(">I", message[22:26])
-                sell_qty, = struct.unpack(">I", message[26:30])
-                buy_qty, = struct.unpack(">I", message[30:34])
-                day_open, = struct.unpack(">f", message[34:38])
-                day_close, = struct.unpack(">f", message[38:42])
-                day_high, = struct.unpack(">f", message[42:46])
-                day_low, = struct.unpack(">f", message[46:50])
-                entry = {
-                    "timestamp": datetime.now().isoformat(),
-                    "ltp": ltp,
-                    "last_traded_qty": last_traded_qty,
-                    "ltt": ltt,
-                    "atp": atp,
-                    "volume": volume,
-                    "sell_qty": sell_qty,
-                    "buy_qty": buy_qty,
-                    "day_open": day_open,
-                    "day_close": day_close,
-                    "day_high": day_high,
-                    "day_low": day_low
-                }
-                self.data_store[str(security_id)] = entry
-                if str(security_id) not in orderflow_history:
-                    orderflow_history[str(security_id)] = []
-                orderflow_history[str(security_id)].append(entry)
-                print(f"[WebSocket] Updated {security_id}: LTP={ltp}, Vol={volume}, Buy={buy_qty}, Sell={sell_qty}, Open={day_open}, Close={day_close}, High={day_high}, Low={day_low}")
-            elif code == 2 and len(message) >= 16:
-                # Ticker Packet
-                ltp, = struct.unpack(">f", message[8:12])
-                ltt, = struct.unpack(">I", message[12:16])
-                print(f"[WebSocket] Ticker: {security_id} LTP={ltp} LTT={ltt}")
-            elif code == 5 and len(message) >= 12:
-                # OI Data
-                oi, = struct.unpack(">I", message[8:12])
-                print(f"[WebSocket] OI: {security_id} OI={oi}")
-            else:
-                print(f"[WebSocket] Unhandled code {code} or unexpected length {len(message)}")
+            mlen = len(message)
+            if mlen < 8:
+                return
+            code, msg_len, segment, security_id = _HDR.unpack_from(message, 0)
+            if debug:
+                logger.debug("[WebSocket] Header: code=%d, msg_len=%d, segment=%d, security_id=%d, length=%d",
+                             code, msg_len, segment, security_id, mlen)
+            handler = self._handlers.get(code)
+            if handler is not None and mlen >= handler[0]:
+                handler[1](message, security_id, debug)
+            elif debug:
+                logger.debug("[WebSocket] Unhandled code %d or unexpected length %d", code, mlen)
         except Exception as e:
-            print("[WebSocket] Error parsing message:", e)
+            # At most one report per second, so a run of bad frames cannot flood the log
+            self._err_count += 1
+            now = time.monotonic()
+            if now - self._err_last > 1.0:
+                logger.error("[WebSocket] %d message parse errors since last report, latest: %s", self._err_count, e)
+                self._err_count = 0
+                self._err_last = now
+
+    def _handle_quote(self, message, security_id, debug):
+        # Quote Packet: queued raw and decoded in batches by flush(); a memoryview slice
+        # trims any trailing bytes without copying the frame
+        self._rx_queue.append(memoryview(message)[:QUOTE_DTYPE.itemsize])
+
+    def _handle_ticker(self, message, security_id, debug):
+        # Ticker Packet
+        ltp, ltt = _TICKER.unpack_from(message, 8)
+        if debug:
+            logger.debug("[WebSocket] Ticker: %s LTP=%s LTT=%s", security_id, ltp, ltt)
+
+    def _handle_oi(self, message, security_id, debug):
+        # OI Data
+        oi, = _OI.unpack_from(message, 8)
+        if debug:
+            logger.debug("[WebSocket] OI: %s OI=%s", security_id, oi)
+
+    def flush(self):
+        """
+        Decode every queued quote frame in one np.frombuffer call and publish the updates
+        """
+        count = len(self._rx_queue)
+        if not count:
+            return
+        frames = [self._rx_queue.popleft() for _ in range(count)]
+        quotes = np.frombuffer(b''.join(frames), dtype=QUOTE_DTYPE)
+        security_ids = quotes['security_id'].tolist()
+        # One receive timestamp per batch, and each column converted to Python values in one call,
+        # in Tick field order
+        timestamp = datetime.now().isoformat()
+        columns = (quotes['ltp'].tolist(), quotes['ltq'].tolist(), quotes['ltt'].tolist(),
+                   quotes['atp'].tolist(), quotes['volume'].tolist(), quotes['sell_qty'].tolist(),
+                   quotes['buy_qty'].tolist(), quotes['day_open'].tolist(), quotes['day_close'].tolist(),
+                   quotes['day_high'].tolist(), quotes['day_low'].tolist())
+        debug = logger.isEnabledFor(logging.DEBUG)
+        sid_keys = self._sid_keys
+        for security_id, values in zip(security_ids, zip(*columns)):
+            entry = Tick(timestamp, *values)
+            key = sid_keys.get(security_id) or str(security_id)
+            self.data_store[key] = entry
+            orderflow_history[key].append(entry)
+            if debug:
+                logger.debug("[WebSocket] Updated %s: LTP=%s, Vol=%s, Buy=%s, Sell=%s, Open=%s, Close=%s, High=%s, Low=%s",
+                             security_id, entry.ltp, entry.volume, entry.buy_qty, entry.sell_qty,
+                             entry.day_open, entry.day_close, entry.day_high, entry.day_low)
+
+    async def _decode_loop(self):
+        # Decode whatever arrived since the last pass; runs on the feed's event loop
+        while True:
+            await asyncio.sleep(QUOTE_FLUSH_SEC)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[WebSocket] Error decoding quote batch: {e}")
 
     def on_error(self, ws, error):
         print("[WebSocket] Error:", error)
@@ -721,28 +1125,69 @@ class DhanWebSocketClient:
     def on_close(self, ws, close_status_code, close_msg):
         print(f"[WebSocket] Closed: {close_status_code} {close_msg}")
 
-    def on_open(self, ws):
-        # Send subscription message (max 100 instruments per message)
-        batch_size = 100
-        for i in range(0, len(self.instrument_list), batch_size):
-            batch = self.instrument_list[i:i+batch_size]
-            subscribe_message = {
-                "RequestCode": 17,
-                "InstrumentCount": len(batch),
-                "InstrumentList": batch
-            }
-            ws.send(json.dumps(subscribe_message))
-            print(f"[WebSocket] Sent subscription for {len(batch)} instruments.")
+    async def on_open(self, ws):
+        # Send the subscription messages prepared in __init__. The server takes one subscription
+        # per message, so cork the socket (Linux) while they are written and let the kernel
+        # coalesce the frames into as few segments as possible
+        sock = ws.transport.get_extra_info('socket') if hasattr(socket, 'TCP_CORK') else None
+        try:
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+        except OSError:
+            sock = None
+        try:
+            for _, message in self._subscriptions:
+                await ws.send(message)
+        finally:
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+        for count, _ in self._subscriptions:
+            print(f"[WebSocket] Sent subscription for {count} instruments.")
+
+    async def run_async(self):
+        """
+        Connect, subscribe and consume the feed, reconnecting whenever the connection drops
+        """
+        decoder = asyncio.ensure_future(self._decode_loop())
+        try:
+            while True:
+                await self._consume()
+                await asyncio.sleep(WS_RECONNECT_SEC)
+        finally:
+            decoder.cancel()
+            self.flush()
+
+    async def _consume(self):
+        # One connection's lifetime; errors are reported and the caller reconnects
+        ws = None
+        try:
+            # Binary quote frames are small and not worth deflating, and none comes near the size cap
+            async with websockets.connect(self.ws_url, compression=None, max_size=WS_MAX_FRAME) as ws:
+                self.ws = ws
+                await self.on_open(ws)
+                async for message in ws:
+                    # A bad frame or batch must not end the receive loop
+                    try:
+                        self.on_message(ws, message)
+                        if len(self._rx_queue) >= QUOTE_BATCH_SIZE:
+                            self.flush()
+                    except Exception as e:
+                        logger.error(f"[WebSocket] Error processing message: {e}")
+            self.on_close(ws, ws.close_code, ws.close_reason)
+        except Exception as e:
+            self.on_error(ws, e)
+
+    def _run_loop(self):
+        loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run_async())
+        finally:
+            loop.close()
 
     def run(self):
-        self.ws = websocket.WebSocketApp(
-            self.ws_url,
-            on_open=self.on_open,
-            on_message=self.on_message,
-            on_error=self.on_error,
-            on_close=self.on_close
-        )
-        wst = threading.Thread(target=self.ws.run_forever)
+        # Receive and decode share one event loop (uvloop when installed) on a daemon thread
+        wst = threading.Thread(target=self._run_loop)
         wst.daemon = True
         wst.start()
         print("[WebSocket] Client started.")
@@ -765,10 +1210,9 @@ if __name__ == "__main__":
         print(f"\n=== Testing {security_id} on {exchange} ===")
         result = analyzer.process_order_flow(security_id, exchange)
         if result:
-            traded_delta = result.get('traded_delta', {})
-            print(f"✅ Success: LTP={result.get('ltp')}, Signal={result.get('signal')}")
-            print(f"   Net Trade Flow: {traded_delta.get('net_trade_flow', 0):.0f}")
-            print(f"   Buy Percentage: {traded_delta.get('buy_percentage', 50):.1f}%")
+            print(f"✅ Success: LTP={result.ltp}, Signal={result.signal}")
+            print(f"   Net Trade Flow: {result.net_trade_flow or 0:.0f}")
+            print(f"   Buy Percentage: {result.buy_percentage if result.buy_percentage is not None else 50:.1f}%")
         else:
             print(f"❌ Failed to get data for {security_id} on {exchange}")
     
@@ -0,0 +1,13 @@
+# Production entrypoint:
+#   gunicorn -k gthread -w 1 --threads 8 -b 0.0.0.0:5000 wsgi:app
+# Importing flask_server starts the market feed and DB writer threads, so run a single
+# worker process and scale request handling with threads.
+#
+# To scale the API across workers, run ingest as its own process and turn it off in the API:
+#   python writer.py
+#   OFLO_RUN_FEED=0 gunicorn -k gthread -w 4 --threads 8 -b 0.0.0.0:5000 wsgi:app
+# writer.py creates the tables and backfills the minute rollup of an older database; the API
+# only reads, so /api/delta_data returns [] until the writer has created them.
+# /api/live_data and /api/orderflow_history are served from the feed's in-memory state,
+# so they only have data in a process that runs the feed.
+from flask_server import app